@@ -3,16 +3,17 @@
 from pathlib import Path
 
 import pandas as pd
-import pandas_indexing as pix
+import pandas_indexing  # noqa: F401 (registers the `.idx` accessor used in get_map)
+import pyarrow.csv as pacsv
 
 
 def get_map(mapping, sector_column, sector_output_column_name="sector_59"):
     """
     Create a MultiIndex mapping between a given sector column and the harmonized sectors.
 
-    This function takes a DataFrame (`mapping`) and creates a pandas `MultiIndex` from
-    the `sector_column` and the "Harmonization Sectors" column. It drops duplicate rows,
-    renames the levels of the index to `sector_59` and `sector`, and removes any null
+    This function takes a DataFrame (`mapping`) and creates a pandas `MultiIndex` directly
+    from the `sector_column` and the "Harmonization Sectors" column arrays. It drops duplicate
+    pairs, names the levels of the index `sector_59` and `sector`, and removes any null
     values from the index.
 
     Parameters
@@ -33,8 +34,11 @@ def get_map(mapping, sector_column, sector_output_column_name="sector_59"):
         the index are dropped.
     """
     return (
-        pd.MultiIndex.from_frame(mapping[[sector_column, "Harmonization Sectors"]].drop_duplicates())
-        .rename([sector_output_column_name, "sector"])
+        pd.MultiIndex.from_arrays(
+            [mapping[sector_column].to_numpy(), mapping["Harmonization Sectors"].to_numpy()],
+            names=[sector_output_column_name, "sector"],
+        )
+        .unique()
         .idx.dropna()
     )
 
@@ -44,10 +48,11 @@ def read_CEDS(path: Path, num_index=4, sector_output_column_name="sector_59"):
     Read a CEDS (Community Emissions Data System) CSV file into a pandas DataFrame.
 
     This function reads a CEDS dataset from a CSV file located at `path` and processes it
-    into a pandas DataFrame. The file is read with `num_index` columns as the index, and
-    the column names are transformed by converting them into integers (removing any leading
-    characters, e.g., "X2010" becomes 2010). The index levels "country" and "sector" are
-    renamed to "region" and "sector_59", respectively.
+    into a pandas DataFrame. The file is read with `pyarrow.csv` and the year columns are
+    renamed on the Arrow table (removing any leading characters, e.g., "X2010" becomes 2010)
+    before the conversion to pandas, where the first `num_index` columns become the index.
+    The index levels "country" and "sector" are renamed to "region" and "sector_59",
+    respectively.
 
     Parameters
     ----------
@@ -62,14 +67,15 @@ def read_CEDS(path: Path, num_index=4, sector_output_column_name="sector_59"):
     pd.DataFrame
         A pandas DataFrame with the processed CEDS data. The index will include `num_index`
         columns, with "country" renamed to "region" and "sector" renamed to "sector_59".
-        The columns will represent years and will be renamed as integers.
+        The columns will represent years and will be renamed as integers, with values stored
+        as float32.
     """
-    df = (
-        pd.read_csv(path, index_col=list(range(num_index)), engine="pyarrow")
-        .rename(columns=lambda s: int(s[1:]))
-        .rename_axis(index={"country": "region", "sector": sector_output_column_name})
-    )
-    return df
+    table = pacsv.read_csv(path)
+    index_columns = table.column_names[:num_index]
+    year_columns = [name[1:] for name in table.column_names[num_index:]]
+    df = table.rename_columns(index_columns + year_columns).to_pandas().set_index(index_columns).astype("float32")
+    df.columns = df.columns.astype(int)
+    return df.rename_axis(index={"country": "region", "sector": sector_output_column_name})
 
 
 def add_global(df, groups=["em", "unit", "sector"]):
@@ -93,7 +99,10 @@ def add_global(df, groups=["em", "unit", "sector"]):
 
     Workflow:
         - Group the DataFrame by "em", "unit", and "sector" (or any other setting to 'groups'), then sum.
-        - Assign the label "World" to the "country" column for these aggregated rows.
+        - Assign the label "World" to the "country" column for these aggregated rows, rebuilding their
+          (small) index in the level order of the original DataFrame.
         - Concatenate the original DataFrame with the new "World" rows.
     """
-    return pix.concat([df, df.groupby(groups).sum().pix.assign(country="World")])
+    world = df.groupby(groups, sort=False, observed=True).sum()
+    world.index = pd.MultiIndex.from_frame(world.index.to_frame(index=False).assign(country="World")[df.index.names])
+    return pd.concat([df, world])
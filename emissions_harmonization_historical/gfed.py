@@ -1,12 +1,14 @@
 """Here we specify functions related to processing GFED (Global Fire Emissions Database) data."""
 
+import hashlib
 from pathlib import Path
 
 import cftime
-import dask
+import dask.array
 import h5py
 import numpy as np
 import pandas as pd
+import scipy.sparse
 import xarray as xr
 
 
@@ -14,6 +16,11 @@ def read_var(dataset, coords):
     """
     Read a dataset and converts it into an xarray DataArray using Dask for delayed computation.
 
+    The dataset is wrapped directly with `dask.array.from_array`, so it is read chunk by chunk
+    (following the on-disk HDF5 chunking where there is one) rather than all at once. Values
+    are cast to float32, which is plenty for the precision of the GFED data and halves the
+    memory traffic of the subsequent aggregations.
+
     Parameters
     ----------
         dataset: The dataset to be converted (e.g., an h5py dataset or similar).
@@ -21,13 +28,10 @@ def read_var(dataset, coords):
 
     Returns
     -------
-        xr.DataArray: The resulting DataArray with delayed loading via Dask, preserving
-        the shape and data type of the original dataset.
+        xr.DataArray: The resulting float32 DataArray with delayed loading via Dask, preserving
+        the shape of the original dataset.
     """
-    return xr.DataArray(
-        dask.array.from_delayed(dask.delayed(np.asarray)(dataset), shape=dataset.shape, dtype=dataset.dtype),
-        coords=coords,
-    )
+    return xr.DataArray(dask.array.from_array(dataset, chunks="auto").astype(np.float32), coords=coords)
 
 
 def read_coords(file):
@@ -187,6 +191,29 @@ def read_year(filename):
     return ds
 
 
+def load_annual_sum(filename, var="DM"):
+    """
+    Read a GFED4 datafile for a specific year and load the annual sum of a single variable.
+
+    The dataset returned by `read_year` reads lazily from an open HDF5 file, which cannot
+    be sent between processes. This function selects one variable, sums it over the months
+    and loads only that (small) result, so that years can be reduced in parallel in separate
+    processes (e.g., with a `ProcessPoolExecutor`) without holding the monthly data in memory.
+    The result is computed with Dask's synchronous scheduler, since the parallelism comes from
+    the processes and each one should not start its own thread pool on top.
+
+    Parameters
+    ----------
+       filename: The file (assumed to be HDF5 format) to read.
+       var (optional): The name of the variable to sum, by default "DM" (dry matter).
+
+    Returns
+    -------
+       xr.DataArray: The in-memory annual sum of `var`, with a "year" dimension of length one.
+    """
+    return read_year(filename)[var].groupby("time.year").sum().load(scheduler="synchronous")
+
+
 def read_cell_area(filename):
     """
     Read the grid cell area data from an HDF5 file.
@@ -214,6 +241,240 @@ def read_cell_area(filename):
     return read_var(file["ancill"]["grid_cell_area"], coords).assign_attrs(unit="m2")
 
 
+def _linear_weights(source, target):
+    """
+    Compute the 1-D linear interpolation neighbours and weights of `target` points on `source`.
+
+    Parameters
+    ----------
+        source: Monotonic source coordinates (ascending or descending).
+        target: Target coordinates.
+
+    Returns
+    -------
+        tuple: The lower and upper neighbour positions in `source`, their weights, and a
+        boolean array marking the targets that lie within the range of `source`.
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    order = np.argsort(source)
+    sorted_source = source[order]
+    pos = np.clip(np.searchsorted(sorted_source, target, side="right") - 1, 0, len(source) - 2)
+    frac = (target - sorted_source[pos]) / (sorted_source[pos + 1] - sorted_source[pos])
+    valid = (target >= sorted_source[0]) & (target <= sorted_source[-1])
+    return order[pos], order[pos + 1], 1 - frac, frac, valid
+
+
+def bilinear_matrix(source_lat, source_lon, target_lat, target_lon):
+    """
+    Build a sparse bilinear interpolation operator between two regular lat/lon grids.
+
+    Applying the operator to a grid flattened in ("lat", "lon") order gives the same values as
+    `xr.DataArray.interp(lat=..., lon=..., method="linear")`, except that target cells outside
+    of the source grid get a weight of zero instead of NaN.
+
+    Parameters
+    ----------
+        source_lat: Latitudes of the source grid.
+        source_lon: Longitudes of the source grid.
+        target_lat: Latitudes of the target grid.
+        target_lon: Longitudes of the target grid.
+
+    Returns
+    -------
+        scipy.sparse.csr_matrix: A matrix of shape (n_target_lat * n_target_lon,
+        n_source_lat * n_source_lon), with at most four non-zeros per row.
+    """
+    lat_lo, lat_hi, lat_wlo, lat_whi, lat_valid = _linear_weights(source_lat, target_lat)
+    lon_lo, lon_hi, lon_wlo, lon_whi, lon_valid = _linear_weights(source_lon, target_lon)
+    n_lon = len(source_lon)
+
+    rows = np.arange(len(target_lat) * len(target_lon)).reshape(len(target_lat), len(target_lon))
+    valid = lat_valid[:, None] & lon_valid[None, :]
+    data, indices = [], []
+    for lat_idx, lat_w in ((lat_lo, lat_wlo), (lat_hi, lat_whi)):
+        for lon_idx, lon_w in ((lon_lo, lon_wlo), (lon_hi, lon_whi)):
+            data.append(np.where(valid, lat_w[:, None] * lon_w[None, :], 0.0))
+            indices.append(lat_idx[:, None] * n_lon + lon_idx[None, :])
+
+    matrix = scipy.sparse.csr_matrix(
+        (
+            np.concatenate([d.ravel() for d in data]),
+            (np.tile(rows.ravel(), 4), np.concatenate([i.ravel() for i in indices])),
+        ),
+        shape=(rows.size, len(source_lat) * n_lon),
+    )
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def iso_cell_matrix(idxr, cell_area):
+    """
+    Build a sparse matrix that sums area-weighted grid cells into countries.
+
+    The country mask assigns (nearly) every grid cell to a single ISO code, so a dense
+    (iso, lat, lon) weight array is almost entirely zeros. Only the non-zero mask entries
+    are kept, with the grid cell area folded into the weights.
+
+    Parameters
+    ----------
+        idxr: An xarray DataArray with dimensions "iso", "lat" and "lon" holding the country
+            share of each grid cell. Missing or NaN entries are treated as 0.
+        cell_area: An xarray DataArray with dimensions "lat" and "lon" holding the area of
+            each grid cell.
+
+    Returns
+    -------
+        scipy.sparse.csr_matrix: A matrix of shape (n_iso, n_lat * n_lon), with grid cells
+        flattened in ("lat", "lon") order of `cell_area`.
+    """
+    cell_area = cell_area.transpose("lat", "lon")
+    mask = idxr.reindex_like(cell_area, fill_value=0).transpose("iso", "lat", "lon")
+    # cells without a mask value do not count towards any country, like the NaN-skipping sum over lat/lon
+    mask = np.nan_to_num(np.asarray(mask), nan=0.0).reshape(idxr.sizes["iso"], -1)
+    rows, cols = np.nonzero(mask)
+    area = np.asarray(cell_area).ravel()
+    return scipy.sparse.csr_matrix((mask[rows, cols] * area[cols], (rows, cols)), shape=mask.shape)
+
+
+def _apply_cell_matrix(values, matrix):
+    """
+    Apply a sparse cell matrix to the two trailing (lat, lon) axes of a numpy array.
+
+    Parameters
+    ----------
+        values: A numpy array with lat and lon as its last two axes.
+        matrix: A sparse matrix of shape (n_out, n_lat * n_lon).
+
+    Returns
+    -------
+        np.ndarray: An array with the two trailing axes replaced by one axis of length n_out.
+    """
+    flat = values.reshape(-1, matrix.shape[1])
+    return (matrix @ flat.T).T.reshape(*values.shape[:-2], matrix.shape[0])
+
+
+def aggregate_cells(da, matrix, index):
+    """
+    Aggregate the "lat" and "lon" dimensions of a DataArray with a sparse cell matrix.
+
+    The kernel is applied with `xr.apply_ufunc`, so Dask-backed input is aggregated lazily
+    chunk by chunk along the other dimensions (the "lat" and "lon" dimensions must not be
+    chunked).
+
+    Parameters
+    ----------
+        da: An xarray DataArray with "lat" and "lon" as dimensions, and any number of other
+            dimensions (e.g., "year").
+        matrix: A sparse matrix of shape (len(index), n_lat * n_lon), like the one returned by
+            `iso_cell_matrix`.
+        index: A named pandas Index labelling the rows of `matrix` (e.g., the ISO codes).
+
+    Returns
+    -------
+        xr.DataArray: The aggregated DataArray, with "lat" and "lon" replaced by a dimension
+        named after `index`.
+    """
+    return xr.apply_ufunc(
+        _apply_cell_matrix,
+        da,
+        kwargs={"matrix": matrix},
+        input_core_dims=[["lat", "lon"]],
+        output_core_dims=[[index.name]],
+        dask="parallelized",
+        output_dtypes=[np.result_type(da.dtype, matrix.dtype)],
+        dask_gufunc_kwargs={"output_sizes": {index.name: len(index)}},
+    ).assign_coords({index.name: index})
+
+
+def _grid_key(*arrays):
+    """
+    Hash a number of arrays (e.g., grid coordinates) into a hex digest.
+
+    Parameters
+    ----------
+        *arrays: Array-likes to hash, in order.
+
+    Returns
+    -------
+        str: The sha256 hex digest over the bytes of all arrays.
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(np.asarray(array)).tobytes())
+    return digest.hexdigest()
+
+
+def country_grid_weights(source_lat, source_lon, idxr, cell_area, cache_file=None):
+    """
+    Build the sparse matrix that regrids GFED cells to the template grid and sums them into countries.
+
+    This combines `bilinear_matrix` and `iso_cell_matrix` into a single (iso x source cell) matrix.
+    Both only depend on the fixed grids and the country mask, so if `cache_file` is given, the
+    matrix is stored there (as .npz) together with a hash of the source and target grids, the
+    ISO codes, the cell areas and the size and modification time of the file `idxr` was opened
+    from, and is loaded from there on later calls with the same hash. This skips loading the
+    full country mask. If `idxr` was not opened from a file (or the backend does not record it,
+    e.g. with `engine="scipy"`), the mask values themselves are hashed instead, so the cache
+    still works but the full mask is loaded on every call.
+
+    Parameters
+    ----------
+        source_lat: Latitudes of the source (GFED) grid.
+        source_lon: Longitudes of the source (GFED) grid.
+        idxr: An xarray DataArray with dimensions "iso", "lat" and "lon" holding the country
+            share of each target grid cell, as opened with `xr.open_dataarray`. Only its
+            coordinates are read on a cache hit.
+        cell_area: An xarray DataArray with dimensions "lat" and "lon" holding the area of
+            each target grid cell.
+        cache_file (optional): Path of the .npz file to cache the matrix in.
+
+    Returns
+    -------
+        tuple: The scipy.sparse.csr_matrix of shape (n_iso, n_source_lat * n_source_lon),
+        and the pandas Index of ISO codes labelling its rows.
+    """
+    iso = idxr.indexes["iso"]
+    mask_file = idxr.encoding.get("source")
+    if mask_file is not None:
+        mask_stat = Path(mask_file).stat()
+        mask_key = np.asarray([mask_stat.st_size, mask_stat.st_mtime_ns], dtype=np.int64)
+    else:
+        # nothing to tell a changed mask apart from the cached one by, so hash its values
+        mask_key = np.asarray(idxr.transpose("iso", "lat", "lon"), dtype=float)
+    cell_area = cell_area.transpose("lat", "lon")
+    key = _grid_key(
+        np.asarray(source_lat, dtype=float),
+        np.asarray(source_lon, dtype=float),
+        np.asarray(cell_area.lat, dtype=float),
+        np.asarray(cell_area.lon, dtype=float),
+        np.asarray(cell_area, dtype=float),
+        np.asarray(iso, dtype=str),
+        mask_key,
+    )
+
+    if cache_file is not None and Path(cache_file).exists():
+        with np.load(cache_file) as cached:
+            if str(cached["key"]) == key:
+                matrix = scipy.sparse.csr_matrix(
+                    (cached["data"], cached["indices"], cached["indptr"]), shape=tuple(cached["shape"])
+                )
+                return matrix, iso
+
+    interp = bilinear_matrix(source_lat, source_lon, cell_area.indexes["lat"], cell_area.indexes["lon"])
+    matrix = iso_cell_matrix(idxr, cell_area) @ interp
+    if cache_file is not None:
+        np.savez_compressed(
+            cache_file,
+            key=key,
+            data=matrix.data,
+            indices=matrix.indices,
+            indptr=matrix.indptr,
+            shape=np.asarray(matrix.shape),
+        )
+    return matrix, iso
+
+
 def add_global(df, groups=["em", "unit", "sector"]):
     """
     Add a "Global" or "World" aggregate row to the DataFrame by summing over all countries.
@@ -231,8 +492,11 @@ def add_global(df, groups=["em", "unit", "sector"]):
     Workflow:
         - Groups the DataFrame by "em", "unit", and "sector" columns, ignoring the "country" dimension.
         - Sums the emissions across all countries for each group.
-        - Assigns the "country" value as "World" to represent global totals.
+        - Assigns the "country" value as "World" to represent global totals, by rebuilding the
+          (small) index of the aggregated rows in the level order of the original DataFrame.
         - Adds these new global rows to the original DataFrame using `pd.concat`.
         - Returns the resulting DataFrame with the added "World" aggregate rows.
     """
-    return pd.concat([df, df.groupby(groups).sum().idx.assign(country="World", order=df.index.names)])
+    world = df.groupby(groups, sort=False, observed=True).sum()
+    world.index = pd.MultiIndex.from_frame(world.index.to_frame(index=False).assign(country="World")[df.index.names])
+    return pd.concat([df, world])
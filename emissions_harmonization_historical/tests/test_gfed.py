@@ -0,0 +1,103 @@
+"""Tests of the GFED regridding and country aggregation."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from emissions_harmonization_historical.gfed import (
+    aggregate_cells,
+    bilinear_matrix,
+    country_grid_weights,
+    iso_cell_matrix,
+)
+
+
+def example_data(seed=0):
+    """
+    Create a small GFED-like source field, a template grid with cell areas and a country mask.
+
+    The source latitudes are descending (as in GFED) and the template grid extends beyond the
+    source grid, so that some target cells fall outside of the source range.
+    """
+    rng = np.random.default_rng(seed)
+    source_lat = np.arange(60.0, -61.0, -10.0)
+    source_lon = np.arange(-150.0, 151.0, 20.0)
+    target_lat = np.arange(-75.0, 76.0, 7.5)
+    target_lon = np.arange(-165.0, 166.0, 15.0)
+
+    da = xr.DataArray(
+        rng.random((3, source_lat.size, source_lon.size)),
+        coords={"year": [2000, 2001, 2002], "lat": source_lat, "lon": source_lon},
+    )
+    area = xr.DataArray(
+        rng.random((target_lat.size, target_lon.size)),
+        coords={"lat": target_lat, "lon": target_lon},
+    )
+    iso = pd.Index(["abc", "def", "ghi"], name="iso")
+    owner = rng.integers(0, len(iso), (target_lat.size, target_lon.size))
+    idxr = xr.DataArray(
+        np.stack([(owner == i).astype(float) for i in range(len(iso))]),
+        coords={"iso": iso, "lat": target_lat, "lon": target_lon},
+    )
+    return da, area, idxr
+
+
+def test_aggregate_cells_matches_interp_and_masked_sum():
+    """Test that the sparse operator reproduces interpolation followed by the masked, area-weighted sum"""
+    da, area, idxr = example_data()
+    regridded = da.interp(lat=area.lat, lon=area.lon, method="linear")
+    # target cells outside of the source grid don't contribute to the sum
+    np.testing.assert_equal(bool(regridded.isnull().any()), True)
+    expected = (regridded * area * idxr).sum(["lat", "lon"])
+
+    matrix = iso_cell_matrix(idxr, area) @ bilinear_matrix(
+        da.indexes["lat"], da.indexes["lon"], area.indexes["lat"], area.indexes["lon"]
+    )
+    result = aggregate_cells(da, matrix, idxr.indexes["iso"])
+
+    xr.testing.assert_allclose(result, expected)
+
+
+def test_country_grid_weights_cache(tmp_path):
+    """Test that the cached matrix is reused, and recomputed once the mask file changes"""
+    da, area, idxr = example_data()
+    mask_file = tmp_path / "mask.nc"
+    cache_file = tmp_path / "grid_ops.npz"
+    idxr.to_netcdf(mask_file)
+
+    def weights():
+        with xr.open_dataarray(mask_file) as mask:
+            return country_grid_weights(da.lat, da.lon, mask, area, cache_file=cache_file)
+
+    # miss: computes and writes the cache
+    expected, iso = weights()
+    np.testing.assert_equal(cache_file.exists(), True)
+    cached_mtime = cache_file.stat().st_mtime_ns
+
+    # hit: loads the same matrix without rewriting the cache
+    matrix, iso_cached = weights()
+    np.testing.assert_equal(cache_file.stat().st_mtime_ns, cached_mtime)
+    np.testing.assert_allclose(matrix.toarray(), expected.toarray())
+    pd.testing.assert_index_equal(iso_cached, iso)
+
+    # a rewritten mask file invalidates the cache
+    changed = idxr.copy(data=idxr.values[::-1])
+    changed.to_netcdf(tmp_path / "changed.nc")
+    os.replace(tmp_path / "changed.nc", mask_file)
+    matrix, _ = weights()
+    np.testing.assert_allclose(matrix.toarray(), expected.toarray()[::-1])
+
+
+def test_country_grid_weights_cache_without_source(tmp_path):
+    """Test that the cache follows the mask values if the mask wasn't opened from a file"""
+    da, area, idxr = example_data()
+    cache_file = tmp_path / "grid_ops.npz"
+
+    expected, _ = country_grid_weights(da.lat, da.lon, idxr, area, cache_file=cache_file)
+    np.testing.assert_equal(cache_file.exists(), True)
+
+    changed = idxr.copy(data=idxr.values[::-1])
+    matrix, _ = country_grid_weights(da.lat, da.lon, changed, area, cache_file=cache_file)
+    np.testing.assert_allclose(matrix.toarray(), expected.toarray()[::-1])
@@ -14,6 +14,7 @@
 
 # +
 # import external packages and functions
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 import pandas_indexing as pix
@@ -60,28 +61,48 @@ ceds_map.to_frame(index=False)
 
 # Read CEDS emissions data
 
-ceds = pd.concat(
-    read_CEDS(
-        Path(ceds_data_folder)
-        / f"{gas}_CEDS_emissions_by_country_sector_v{ceds_release}.csv"
+# read all gas files in parallel (the pyarrow csv reader releases the GIL), then concatenate once
+with ThreadPoolExecutor(max_workers=len(gases)) as executor:
+    ceds_frames = list(
+        executor.map(
+            lambda gas: read_CEDS(
+                Path(ceds_data_folder)
+                / f"{gas}_CEDS_emissions_by_country_sector_v{ceds_release}.csv"
+            ),
+            gases,
+        )
     )
-    for gas in gases
-).rename_axis(index={"region": "country"})
+ceds = pd.concat(ceds_frames, sort=False).rename_axis(index={"region": "country"})
 ceds.attrs["name"] = "CEDS21"
 ceds = ceds.pix.semijoin(ceds_map, how="outer")
 ceds.loc[isna].pix.unique(["sector_59", "sector"]) # print sectors with NAs
 
-ceds = ceds.pix.dropna(subset=["units"]).pix.format(unit="{units}/yr", drop=True) # adjust units
-ceds = pix.units.convert_unit(ceds, lambda x: "Mt " + x.removeprefix("kt").strip()) # adjust units
-
-ceds = ceds.groupby(["em", "country", "unit", "sector"]).sum().pix.fixna() # group and fix NAs
+# adjust units, by mapping the handful of unique unit labels once instead of formatting every row
+ceds = ceds.pix.dropna(subset=["units"])
+ceds = ceds.rename(
+    index={units: f"{units}/yr" for units in ceds.index.unique("units")}, level="units"
+).rename_axis(index={"units": "unit"})
+ceds = pix.units.convert_unit(
+    ceds, {unit: "Mt " + unit.removeprefix("kt").strip() for unit in ceds.index.unique("unit")}
+)
 
 # aggregate countries where this is necessary, e.g. because of specific other data (like SSP socioeconomic driver data)
 # TODO: check this based on the new SSP data (because old SSP data only had the sum); so recheck.
 country_combinations = {"isr_pse": ["isr", "pse"],
                         "sdn_ssd": ["ssd", "sdn"],
                         "srb_ksv": ["srb", "srb (kosovo)"]}
-ceds = ceds.pix.aggregate(country=country_combinations)
+# the combined countries are only renamed here, they are summed up by the groupby below
+ceds = ceds.rename(
+    index={country: combined for combined, countries in country_combinations.items() for country in countries},
+    level="country",
+)
+
+# make the index levels categorical right before grouping (the semijoin and renames above rebuild them as
+# plain levels), so that the groupbys (also the one in add_global) hash integer codes instead of strings
+ceds.index = ceds.index.set_levels([pd.CategoricalIndex(level) for level in ceds.index.levels])
+ceds = ceds.groupby(["em", "country", "unit", "sector"], sort=False, observed=True).sum().pix.fixna() # group and fix NAs
+# the raw data is read as float32 to save memory, but the aggregated data is small, so totals and outputs keep float64
+ceds = ceds.astype("float64")
 
 # add global
 ceds = add_global(ceds)
@@ -108,12 +129,19 @@ ceds.pix.unique(unit_wishes.names).symmetric_difference(unit_wishes)
 # Save formatted CEDS data
 
 # +
-# reformat
-ceds_ref = (
-    ceds
-    .droplevel("unit")
-    .pix.semijoin(unit_wishes, how="left")
-    .rename_axis(index={"em": "gas"})
+# reformat, by only replacing the index (the data itself is not copied):
+# the unit is replaced by the wished unit of each gas (NaN for gases without one, like a left join on unit_wishes)
+ems = ceds.index.get_level_values("em")
+ceds_ref = ceds.set_axis(
+    pd.MultiIndex.from_arrays(
+        [
+            ems,
+            ceds.index.get_level_values("country"),
+            ceds.index.get_level_values("sector"),
+            ems.map(dict(unit_wishes.to_list())),
+        ],
+        names=["gas", "country", "sector", "unit"],
+    )
 )
 
 
@@ -123,3 +151,9 @@ ceds_ref = (
     ceds_ref
     .to_csv(ceds_processed_output_file)
 )
+
+# also save as parquet, which keeps the index and integer years for downstream consumers (like the GFED output)
+(
+    ceds_ref
+    .to_parquet(ceds_processed_output_file.with_suffix(".parquet"))
+)
@@ -14,7 +14,9 @@
 
 # +
 # import external packages and functions
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import ptolemy
 import xarray as xr
@@ -33,7 +35,10 @@ from emissions_harmonization_historical.gfed import (
     # read_monthly,
     # month_to_cftime,
     read_year,
+    load_annual_sum,
     read_cell_area,
+    country_grid_weights,
+    aggregate_cells,
     add_global
 )
 
@@ -55,9 +60,11 @@ gfed_nmvoc_aux_conversion = Path(gfed_data_aux_folder, "NMVOC-species.xlsx") # f
 voc_unit = "kg VOC" # or kg C
 gfed_isomask = Path(gfed_data_aux_folder, "iso_mask.nc") # for aggregating to countries
 gfed_grid_template = Path(gfed_data_aux_folder, "BC-em-openburning_input4MIPs_emissions_CMIP_REMIND-MAGPIE-SSP5-34-OS-V1_gn_201501-210012.nc") # for country-level grid emissions reporting template
+gfed_grid_cache = Path(gfed_data_aux_folder, "grid_ops.npz") # cache of the regridding and country aggregation weights (recomputed if the grids change)
 
 gfed_processed_output_file = Path("..", "data", "national", "gfed", "processed", "gfed_cmip7_national_alpha.csv")
-gfed_temp_file = Path("..", "data", "national", "gfed", "processed", "gfed_temporaryfile.csv")
+gfed_temp_file = Path("..", "data", "national", "gfed", "processed", "gfed_temporaryfile.parquet")
+debug_intermediate = False # whether to also write the intermediate data before reformatting to gfed_temp_file
 # -
 
 # Specify gases to processes
@@ -85,11 +92,12 @@ sector_mapping = {
 
 # Load raw emissions data
 
-# load raw emissions data
+# load raw emissions data (lazily, the data is only read where it is used)
+gfed_files = sorted(gfed_data_folder.glob("*.hdf5"), key=lambda p: p.stem)
 emissions = xr.concat(
     [
         read_year(filename)
-        for filename in sorted(gfed_data_folder.glob("*.hdf5"), key=lambda p: p.stem)
+        for filename in gfed_files
     ],
     dim="time",
 )
@@ -104,15 +112,18 @@ emissions
 # Get emissions factor for different species
 
 # +
-_, marker, *sectors = pd.read_csv(
-    gfed_emission_factors, sep="\s+", skiprows=15, nrows=1, header=None
-).iloc[0]
+with open(gfed_emission_factors) as f:
+    _, marker, *sectors = f.readlines()[15].split()
 assert (
     marker == "SPECIE"
 ), f"header in {gfed_emission_factors} is not in line 16 anymore or looks different"
 
-ef = pd.read_csv(gfed_emission_factors, sep="\s+", header=None, names=sectors, comment="#").rename_axis(
-    index="em", columns="sector"
+# the table starts after the header and the "-----" separator line in line 17
+ef_table = np.loadtxt(gfed_emission_factors, dtype=str, comments="#", skiprows=17)
+ef = pd.DataFrame(
+    ef_table[:, 1:].astype(float),
+    index=pd.Index(ef_table[:, 0], name="em"),
+    columns=pd.Index(sectors, name="sector"),
 )
 
 # Aggregate NMVOC to a total in terms of kgC
@@ -135,7 +146,8 @@ elif voc_unit == "kg VOC":
 else:
     raise NotImplementedError(f"voc_unit must be 'kg VOC' or 'kg C', not: '{voc_unit}'")
 
-ef.loc["NMVOC"] = ef.multiply(nmvoc_factors, axis=0).sum()
+# weighted sum over the NMVOC species as a single matrix-vector product (species missing in ef count as 0, as before)
+ef.loc["NMVOC"] = nmvoc_factors.to_numpy() @ ef.reindex(nmvoc_factors.index, fill_value=0).to_numpy()
 
 ef_per_DM = (
     ef.loc[gases]
@@ -156,24 +168,31 @@ idxr = xr.open_dataarray(gfed_isomask, chunks={'iso': 1})
 # Step 2: Open a NetCDF file to use as a grid template for latitude and longitude coordinates.
 # The template file provides the lat/lon grid for regridding the emissions data.
 with xr.open_dataset(gfed_grid_template) as template:
-    # Interpolate the "DM" (Dry Matter) emissions data to the lat/lon grid from the template,
-    # using linear interpolation. This matches the emissions data to the same grid resolution.
-    dm_regrid = emissions["DM"].interp(lon=template.lon, lat=template.lat, method="linear")
+    grid_lat = template.lat.load()
+    grid_lon = template.lon.load()
 
 # Step 3: Compute the area of each grid cell using the 'ptolemy.cell_area' function.
-# This function calculates the area of each grid cell based on the interpolated lat/lon grid.
+# This function calculates the area of each grid cell based on the template lat/lon grid.
 # The resulting cell areas are stored in an xarray DataArray, with units of square meters ("m2").
-cell_area = xr.DataArray(ptolemy.cell_area(lats=dm_regrid.lat, lons=dm_regrid.lon), attrs=dict(unit="m2"))
+cell_area = xr.DataArray(ptolemy.cell_area(lats=grid_lat, lons=grid_lon), attrs=dict(unit="m2"))
 
-# calculate emissions by country by: taking the country cell IDs (idxr), multiplying it by the area (cell_area), and by the regridded lat/lon grid resummed to per year (dm_regrid.groupby("time.year").sum())
 # Step 4: Calculate emissions by country.
-# This is done by multiplying the regridded Dry Matter (DM) emissions data by the grid cell areas (cell_area)
-# and by the ISO country cell IDs (idxr).
-# The emissions are then summed over the lat/lon grid for each year (grouping by "time.year").
+# This is done by summing the Dry Matter (DM) emissions data to per year (grouping by "time.year"),
+# regridding it, and weighting each grid cell by its area (cell_area) and the ISO country cell IDs (idxr).
+# Since the GFED and template grids are fixed, the linear interpolation to the template grid is baked into
+# a sparse matrix with four weights per template cell. Every grid cell belongs to (nearly) a single country,
+# so the country weights are a sparse (iso x cell) matrix, too. Interpolation is linear, so it commutes with
+# the yearly sum and both can be fused into a single (iso x GFED cell) matrix, applied in one sparse matrix
+# product. The fused matrix is cached in gfed_grid_cache, so re-runs skip loading the full country mask.
 # Finally, we get the emissions (in unit kg DM / a) by multiplying by the emissions factor (ef_per_DM).
+# The yearly DM sums are computed in parallel processes, one per year, so only the sums are kept in memory.
+with ProcessPoolExecutor(max_workers=min(len(gfed_files), os.cpu_count())) as executor:
+    dm_year = xr.concat(list(executor.map(load_annual_sum, gfed_files)), dim="year")
+iso_weights, iso = country_grid_weights(
+    emissions.indexes["lat"], emissions.indexes["lon"], idxr, cell_area, cache_file=gfed_grid_cache
+)
 country_emissions = (
-    (dm_regrid.groupby("time.year").sum() * cell_area * idxr)
-    .sum(["lat", "lon"])
+    aggregate_cells(dm_year, iso_weights, iso)
     .assign_attrs(dict(unit="kg DM / a"))
     * xr.DataArray(ef_per_DM)
 ).compute()
@@ -205,25 +224,19 @@ emissions_df = (
     .pix.convert_unit(lambda u: u.replace("kg", "kt"))
 )
 
-# Intermediary save before reformatting
+# Intermediary save before reformatting (only for debugging, the data is kept in memory)
 
 # intermediary save
-(
-    emissions_df
-    .to_csv(gfed_temp_file)
-)
+if debug_intermediate:
+    (
+        emissions_df
+        .to_parquet(gfed_temp_file)
+    )
 
 # Reformat, including updated variable naming
 
 # +
-burningCMIP7 = (
-    pd.read_csv(
-        gfed_temp_file,
-        index_col=list(range(4)),
-    )
-    .rename(columns=int)
-    .rename_axis(columns="year")
-)
+burningCMIP7 = emissions_df
 
 # burningCMIP7.pix
 # -
@@ -281,3 +294,9 @@ burningCMIP7_ref.pix
     burningCMIP7_ref
     .to_csv(gfed_processed_output_file)
 )
+
+# also save as parquet, which keeps dtypes and the index for downstream consumers
+(
+    burningCMIP7_ref
+    .to_parquet(gfed_processed_output_file.with_suffix(".parquet"))
+)